@@ -1,41 +1,491 @@
 import os
+import sys
+import json
+import time
+import zlib
+import queue
+import atexit
+import random
+import functools
+import threading
+import traceback
+import hashlib
+import asyncio
 import logging
+import logging.handlers
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 
+import httpx
 import requests
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent
+)
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    InlineQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    BaseUpdateProcessor,
     ContextTypes,
     filters
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+# Графики прогноза (необязательная зависимость: без matplotlib прогноз отправляется текстом)
+try:
+    from matplotlib.figure import Figure
+    from matplotlib.dates import DateFormatter
+except ImportError:
+    Figure = None
+
+# HTTP/2 для запросов к Telegram (необязательная зависимость: без h2 используется HTTP/1.1)
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования: запись идёт из фонового потока через очередь,
+# обработчики только кладут запись в очередь и не ждут вывода
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Доля сохраняемых записей о каждом сообщении, когда очередь заполнена выше порога
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+LOG_SAMPLE_THRESHOLD = float(os.getenv('LOG_SAMPLE_THRESHOLD', '0.5'))
+
+
+class StructuredFormatter(logging.Formatter):
+    """Формат с дополнительными полями записи (чат, обработчик, задержка)"""
+
+    FIELDS = ('chat_id', 'handler', 'latency')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = ' '.join(
+            f"{name}={getattr(record, name)}" for name in self.FIELDS if hasattr(record, name)
+        )
+        return f"{text} [{fields}]" if fields else text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Постановка записи в очередь без форматирования и без ожидания"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        # Записи, отброшенные из-за переполненной очереди: всего и на момент последнего отчёта
+        self.dropped = 0
+        self.reported_dropped = 0
+
+    def prepare(self, record):
+        # Сообщение форматируется в потоке записи, а не в цикле событий
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def report_dropped(self):
+        """Предупреждение в лог, если с прошлого отчёта записи отбрасывались"""
+        dropped = self.dropped
+        if dropped > self.reported_dropped:
+            logging.getLogger(__name__).warning(
+                "Очередь логов переполнена, отброшено записей: %d (всего %d)",
+                dropped - self.reported_dropped, dropped
+            )
+            self.reported_dropped = dropped
+
+
+class LoadSamplingFilter(logging.Filter):
+    """Прореживание записей о каждом сообщении (extra sampled=True) под нагрузкой"""
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.queue = log_queue
+        self.threshold = LOG_QUEUE_SIZE * LOG_SAMPLE_THRESHOLD
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or self.queue.qsize() < self.threshold:
+            return True
+        return random.random() < LOG_SAMPLE_RATE
+
+
+def setup_logging():
+    """Логирование через очередь с фоновым потоком записи"""
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(StructuredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(LoadSamplingFilter(log_queue))
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+log_queue_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
 
+# Время жизни кэша погоды (секунды): текущая погода, прогноз и качество воздуха
+CACHE_TTL = int(os.getenv('CACHE_TTL', '600'))
+FORECAST_CACHE_TTL = int(os.getenv('FORECAST_CACHE_TTL', '1800'))
+AIR_POLLUTION_CACHE_TTL = int(os.getenv('AIR_POLLUTION_CACHE_TTL', '3600'))
+
+# Сколько ждать части полного отчёта, прежде чем отправить отчёт без неё (секунды)
+REPORT_PART_TIMEOUT = float(os.getenv('REPORT_PART_TIMEOUT', '3'))
+# Потоки для частей полного отчёта: опоздавшие части не занимают общий пул
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '8'))
+
+# Снимок кэша на диске для тёплого перезапуска
+CACHE_SNAPSHOT_PATH = os.getenv('CACHE_SNAPSHOT_PATH', 'weather_cache.json')
+CACHE_SNAPSHOT_INTERVAL = int(os.getenv('CACHE_SNAPSHOT_INTERVAL', '60'))
+
+# Транспорт запросов к OpenWeather: live, record (запись фикстур) или replay (без сети)
+WEATHER_TRANSPORT = os.getenv('WEATHER_TRANSPORT', 'live')
+WEATHER_FIXTURES_DIR = os.getenv('WEATHER_FIXTURES_DIR', 'fixtures')
+WEATHER_REPLAY_REALTIME = os.getenv('WEATHER_REPLAY_REALTIME', '0') == '1'
+
+# Исходящие запросы к Telegram Bot API: размер пула соединений, HTTP/2
+# и время жизни простаивающего соединения (секунды)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '512'))
+TELEGRAM_HTTP2 = os.getenv('TELEGRAM_HTTP2', '1') == '1'
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv('TELEGRAM_KEEPALIVE_EXPIRY', '60'))
+
+# Тайм-ауты (секунды): ответы пользователю должны быстро завершаться ошибкой,
+# массовые отправки (рассылка, группы) могут подождать свободного соединения
+INTERACTIVE_TIMEOUTS = {
+    'connect_timeout': float(os.getenv('INTERACTIVE_CONNECT_TIMEOUT', '5')),
+    'read_timeout': float(os.getenv('INTERACTIVE_READ_TIMEOUT', '5')),
+    'write_timeout': float(os.getenv('INTERACTIVE_WRITE_TIMEOUT', '5')),
+    'pool_timeout': float(os.getenv('INTERACTIVE_POOL_TIMEOUT', '1'))
+}
+BULK_TIMEOUTS = {
+    'connect_timeout': float(os.getenv('BULK_CONNECT_TIMEOUT', '10')),
+    'read_timeout': float(os.getenv('BULK_READ_TIMEOUT', '20')),
+    'write_timeout': float(os.getenv('BULK_WRITE_TIMEOUT', '20')),
+    'pool_timeout': float(os.getenv('BULK_POOL_TIMEOUT', '30'))
+}
+
+# Не отправлять статус «печатает…», если ответ уже есть в кэше
+SKIP_CACHED_CHAT_ACTION = os.getenv('SKIP_CACHED_CHAT_ACTION', '1') == '1'
+
+# Время кэширования инлайн-ответов на стороне Telegram (секунды)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+# Не больше 50 результатов (ограничение Telegram) и фоновых обновлений на один запрос
+INLINE_MAX_RESULTS = 50
+INLINE_MAX_REFRESHES = int(os.getenv('INLINE_MAX_REFRESHES', '3'))
+
+# Максимум одновременно обрабатываемых обновлений (обновления одного чата идут по порядку)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+# Сторожевой таймер цикла событий: период замера задержки и порог зависания (секунды)
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '1'))
+
+# Локальный эндпоинт /health и /ready (порт 0 отключает); при ошибках API бот готов,
+# только если последний успешный запрос был не раньше READY_MAX_FETCH_AGE секунд назад
+HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8080'))
+READY_MAX_FETCH_AGE = int(os.getenv('READY_MAX_FETCH_AGE', '3600'))
+
+# Ограничение частоты запросов пользователя: скорость пополнения (токенов в секунду),
+# размер всплеска и максимальное число отслеживаемых пользователей
+RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', '0.5'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '5'))
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', '100000'))
+
+# Рассылка: окно, по которому растягиваются отправки слота, и упреждение,
+# с которым погода для слота загружается заранее (секунды).
+# PRERENDER_LEAD + DELIVERY_WINDOW должно быть меньше CACHE_TTL.
+DELIVERY_WINDOW = int(os.getenv('DELIVERY_WINDOW', '300'))
+PRERENDER_LEAD = int(os.getenv('PRERENDER_LEAD', '120'))
+
+# Состояние рассылок на диске: каталог, допустимое опоздание для возобновления
+# прерванной рассылки и время ожидания текущих отправок при остановке (секунды)
+BROADCAST_STATE_DIR = os.getenv('BROADCAST_STATE_DIR', 'broadcasts')
+BROADCAST_LATENESS = int(os.getenv('BROADCAST_LATENESS', '1800'))
+BROADCAST_DRAIN_TIMEOUT = int(os.getenv('BROADCAST_DRAIN_TIMEOUT', '30'))
+
+# Поиск города по свободному тексту: сходство триграмм (0..1), при котором совпадение
+# принимается без геокодирования, и минимальное сходство, если геокодирование ничего не нашло;
+# файл с результатами геокодирования OpenWeather, включая промахи
+FUZZY_CONFIDENT_THRESHOLD = float(os.getenv('FUZZY_CONFIDENT_THRESHOLD', '0.75'))
+FUZZY_MATCH_THRESHOLD = float(os.getenv('FUZZY_MATCH_THRESHOLD', '0.5'))
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', 'geocode_cache.json')
+# Пределы кэша геокодирования: найденные города (они же добавляются в список городов)
+# и промахи, которые хранятся не дольше GEOCODE_MISS_TTL секунд
+GEOCODE_MAX_PLACES = int(os.getenv('GEOCODE_MAX_PLACES', '1000'))
+GEOCODE_MAX_MISSES = int(os.getenv('GEOCODE_MAX_MISSES', '5000'))
+GEOCODE_MISS_TTL = int(os.getenv('GEOCODE_MISS_TTL', '604800'))
+
 # ID городов для OpenWeatherMap
 CITIES = {
     'Севастополь': {'lat': 44.6167, 'lon': 33.5254},
     'Симферополь': {'lat': 44.9572, 'lon': 34.1108}
 }
 
+# Локализация: погода запрашивается один раз в каноническом виде (metric, без lang),
+# а описания, единицы и шкала давления переводятся локально по таблицам
+LANGUAGES = ('ru', 'en')
+UNIT_SYSTEMS = ('metric', 'imperial')
+
+CITY_NAMES = {
+    'Севастополь': {'en': 'Sevastopol'},
+    'Симферополь': {'en': 'Simferopol'}
+}
+
+# Описания погодных условий по коду OpenWeather
+CONDITIONS = {
+    'ru': {
+        200: 'гроза с небольшим дождём', 201: 'гроза с дождём', 202: 'гроза с сильным дождём',
+        210: 'слабая гроза', 211: 'гроза', 212: 'сильная гроза', 221: 'прерывистая гроза',
+        230: 'гроза с мелкой моросью', 231: 'гроза с моросью', 232: 'гроза с сильной моросью',
+        300: 'слабая морось', 301: 'морось', 302: 'сильная морось',
+        310: 'слабый моросящий дождь', 311: 'моросящий дождь', 312: 'сильный моросящий дождь',
+        313: 'ливень с моросью', 314: 'сильный ливень с моросью', 321: 'ливневая морось',
+        500: 'небольшой дождь', 501: 'дождь', 502: 'сильный дождь', 503: 'очень сильный дождь',
+        504: 'проливной дождь', 511: 'ледяной дождь', 520: 'небольшой ливень', 521: 'ливень',
+        522: 'сильный ливень', 531: 'прерывистый ливень',
+        600: 'небольшой снег', 601: 'снег', 602: 'сильный снег', 611: 'мокрый снег',
+        612: 'небольшой мокрый снег', 613: 'ливневый мокрый снег', 615: 'небольшой дождь со снегом',
+        616: 'дождь со снегом', 620: 'небольшой снегопад', 621: 'снегопад', 622: 'сильный снегопад',
+        701: 'дымка', 711: 'дым', 721: 'мгла', 731: 'песчаные вихри', 741: 'туман', 751: 'песок',
+        761: 'пыль', 762: 'вулканический пепел', 771: 'шквалы', 781: 'торнадо',
+        800: 'ясно', 801: 'небольшая облачность', 802: 'переменная облачность',
+        803: 'облачно с прояснениями', 804: 'пасмурно'
+    },
+    'en': {
+        200: 'thunderstorm with light rain', 201: 'thunderstorm with rain', 202: 'thunderstorm with heavy rain',
+        210: 'light thunderstorm', 211: 'thunderstorm', 212: 'heavy thunderstorm', 221: 'ragged thunderstorm',
+        230: 'thunderstorm with light drizzle', 231: 'thunderstorm with drizzle', 232: 'thunderstorm with heavy drizzle',
+        300: 'light intensity drizzle', 301: 'drizzle', 302: 'heavy intensity drizzle',
+        310: 'light intensity drizzle rain', 311: 'drizzle rain', 312: 'heavy intensity drizzle rain',
+        313: 'shower rain and drizzle', 314: 'heavy shower rain and drizzle', 321: 'shower drizzle',
+        500: 'light rain', 501: 'moderate rain', 502: 'heavy intensity rain', 503: 'very heavy rain',
+        504: 'extreme rain', 511: 'freezing rain', 520: 'light intensity shower rain', 521: 'shower rain',
+        522: 'heavy intensity shower rain', 531: 'ragged shower rain',
+        600: 'light snow', 601: 'snow', 602: 'heavy snow', 611: 'sleet',
+        612: 'light shower sleet', 613: 'shower sleet', 615: 'light rain and snow',
+        616: 'rain and snow', 620: 'light shower snow', 621: 'shower snow', 622: 'heavy shower snow',
+        701: 'mist', 711: 'smoke', 721: 'haze', 731: 'sand/dust whirls', 741: 'fog', 751: 'sand',
+        761: 'dust', 762: 'volcanic ash', 771: 'squalls', 781: 'tornado',
+        800: 'clear sky', 801: 'few clouds', 802: 'scattered clouds',
+        803: 'broken clouds', 804: 'overcast clouds'
+    }
+}
+
+LABELS = {
+    'ru': {
+        'weather_title': 'Погода в {city}',
+        'forecast_title': 'Прогноз погоды в {city} на 24 часа',
+        'temperature': 'Температура',
+        'feels_like': 'Ощущается как',
+        'humidity': 'Влажность',
+        'pressure': 'Давление',
+        'wind': 'Ветер',
+        'gust': 'Порывы ветра',
+        'precipitation': 'Осадки, мм',
+        'sunrise': 'Восход',
+        'sunset': 'Закат',
+        'air_quality': 'Качество воздуха',
+        'aqi_levels': ('хорошее', 'удовлетворительное', 'умеренное', 'плохое', 'очень плохое'),
+        'concentration_unit': 'мкг/м³',
+        'part_unavailable': 'Часть данных сейчас недоступна',
+        'date_format': '%d.%m.%Y %H:%M'
+    },
+    'en': {
+        'weather_title': 'Weather in {city}',
+        'forecast_title': '24-hour forecast for {city}',
+        'temperature': 'Temperature',
+        'feels_like': 'Feels like',
+        'humidity': 'Humidity',
+        'pressure': 'Pressure',
+        'wind': 'Wind',
+        'gust': 'Wind gusts',
+        'precipitation': 'Precipitation, mm',
+        'sunrise': 'Sunrise',
+        'sunset': 'Sunset',
+        'air_quality': 'Air quality',
+        'aqi_levels': ('good', 'fair', 'moderate', 'poor', 'very poor'),
+        'concentration_unit': 'µg/m³',
+        'part_unavailable': 'Some data is currently unavailable',
+        'date_format': '%Y-%m-%d %H:%M'
+    }
+}
+
+# Единицы скорости ветра по системе единиц и языку
+SPEED_UNITS = {
+    'metric': {'ru': 'м/с', 'en': 'm/s'},
+    'imperial': {'ru': 'миль/ч', 'en': 'mph'}
+}
+
+# Шкалы давления: множитель от гПа, знаков после запятой, обозначение по языку
+PRESSURE_SCALES = {
+    'mmhg': (0.750062, 0, {'ru': 'мм рт.ст.', 'en': 'mmHg'}),
+    'hpa': (1.0, 0, {'ru': 'гПа', 'en': 'hPa'}),
+    'inhg': (0.02953, 2, {'ru': 'дюйм рт.ст.', 'en': 'inHg'})
+}
+
+
+def get_pressure_scale(lang: str, units: str) -> str:
+    """Шкала давления, привычная для языка и системы единиц"""
+    if units == 'imperial':
+        return 'inhg'
+    return 'mmhg' if lang == 'ru' else 'hpa'
+
+
+def convert_temperature(celsius: float, units: str) -> float:
+    """Перевод температуры из °C"""
+    return celsius * 9 / 5 + 32 if units == 'imperial' else celsius
+
+
+def temperature_unit(units: str) -> str:
+    return '°F' if units == 'imperial' else '°C'
+
+
+def convert_speed(meters_per_second: float, units: str) -> float:
+    """Перевод скорости из м/с"""
+    return meters_per_second * 2.23694 if units == 'imperial' else meters_per_second
+
+
+def describe_condition(condition_id: int, lang: str, fallback: str = '') -> str:
+    """Описание погоды по коду условия"""
+    return CONDITIONS[lang].get(condition_id, fallback).capitalize()
+
+
+def city_title(city_name: str, lang: str) -> str:
+    """Название города на языке пользователя"""
+    return CITY_NAMES.get(city_name, {}).get(lang, city_name)
+
+
+# Поиск города по свободному тексту
+# Дополнительные названия городов (английские названия из CITY_NAMES добавляются сами)
+CITY_ALIASES = {
+    'Севастополь': ('Sebastopol',)
+}
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya'
+}
+
+
+def normalize_city(text: str) -> str:
+    """Название города латиницей в нижнем регистре, без знаков препинания"""
+    latin = ''.join(TRANSLIT.get(char, char) for char in text.strip().lower())
+    words = ''.join(char if char.isalnum() and char.isascii() else ' ' for char in latin)
+    return ' '.join(words.split())
+
+
+def trigrams(text: str) -> set:
+    """Триграммы строки с границами слова"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CityIndex:
+    """Нечёткий поиск города по триграммам названий, транслитераций и синонимов"""
+
+    def __init__(self, threshold: float = FUZZY_CONFIDENT_THRESHOLD):
+        self.threshold = threshold
+        # Нормализованное название -> (город, число триграмм)
+        self._names = {}
+        # Триграмма -> нормализованные названия, в которых она встречается
+        self._postings = {}
+
+    def add(self, city_name: str, aliases=()):
+        """Добавление города под его названием и синонимами"""
+        for name in (city_name, *aliases):
+            key = normalize_city(name)
+            if not key or key in self._names:
+                continue
+
+            grams = trigrams(key)
+            self._names[key] = (city_name, len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+
+    def search(self, text: str, threshold: Optional[float] = None) -> Optional[str]:
+        """Город с наибольшим сходством (коэффициент Дайса) не ниже порога"""
+        key = normalize_city(text)
+        if not key:
+            return None
+        if key in self._names:
+            return self._names[key][0]
+
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for name in self._postings.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+
+        best_name, best_score = None, self.threshold if threshold is None else threshold
+        for name, count in shared.items():
+            score = 2 * count / (len(grams) + self._names[name][1])
+            if score >= best_score:
+                best_name, best_score = name, score
+
+        return self._names[best_name][0] if best_name else None
+
+
+city_index = CityIndex()
+for city_name in CITIES:
+    city_index.add(city_name, (*CITY_NAMES.get(city_name, {}).values(), *CITY_ALIASES.get(city_name, ())))
+
+
+def localize_weather(weather_data: dict, lang: str = 'ru', units: str = 'metric') -> dict:
+    """Значения погоды для отображения на языке и в единицах пользователя"""
+    factor, digits, pressure_units = PRESSURE_SCALES[get_pressure_scale(lang, units)]
+
+    return {
+        'city': city_title(weather_data['city'], lang),
+        'temperature': round(convert_temperature(weather_data['temperature'], units)),
+        'feels_like': round(convert_temperature(weather_data['feels_like'], units)),
+        'temp_unit': temperature_unit(units),
+        'description': describe_condition(weather_data['condition_id'], lang, weather_data['description']),
+        'humidity': weather_data['humidity'],
+        'pressure': round(weather_data['pressure'] * factor, digits or None),
+        'pressure_unit': pressure_units[lang],
+        'wind_speed': round(convert_speed(weather_data['wind_speed'], units), 1),
+        'wind_gust': round(convert_speed(weather_data['wind_gust'], units), 1),
+        'speed_unit': SPEED_UNITS[units][lang],
+        'timestamp': weather_data['timestamp'].strftime(LABELS[lang]['date_format'])
+    }
+
 
 # Клавиатура с кнопками
 def get_main_keyboard():
@@ -67,12 +517,232 @@ def get_schedule_keyboard():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+# Транспорт для запросов к OpenWeather
+class HttpTransport:
+    """Запросы к API по сети"""
+
+    def __init__(self, timeout: int = 10):
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def get(self, url: str, params: dict) -> dict:
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def _public_params(params: dict) -> dict:
+    """Параметры запроса без ключа API"""
+    return {key: value for key, value in params.items() if key != 'appid'}
+
+
+def _fixture_path(fixtures_dir: str, url: str, params: dict) -> str:
+    """Файл фикстуры для запроса"""
+    request_id = json.dumps([url, sorted(_public_params(params).items())], ensure_ascii=False, default=str)
+    digest = hashlib.sha1(request_id.encode()).hexdigest()[:16]
+    return os.path.join(fixtures_dir, f"{digest}.json")
+
+
+class RecordingTransport:
+    """Запись ответов API в каталог фикстур"""
+
+    def __init__(self, inner, fixtures_dir: str):
+        self.inner = inner
+        self.fixtures_dir = fixtures_dir
+        os.makedirs(fixtures_dir, exist_ok=True)
+        # Запросы идут из разных потоков, а временный файл у фикстуры один
+        self._lock = threading.Lock()
+
+    def get(self, url: str, params: dict) -> dict:
+        started = time.monotonic()
+        data = self.inner.get(url, params)
+        elapsed = time.monotonic() - started
+
+        record = {
+            'url': url,
+            'params': _public_params(params),
+            'elapsed': round(elapsed, 3),
+            'body': data
+        }
+        path = _fixture_path(self.fixtures_dir, url, params)
+        # Ошибка записи фикстуры не должна ломать сам запрос
+        try:
+            with self._lock:
+                with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                    json.dump(record, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.error("Ошибка при записи фикстуры: %s", e)
+
+        return data
+
+
+class ReplayTransport:
+    """Воспроизведение записанных ответов без сети"""
+
+    def __init__(self, fixtures_dir: str, realtime: bool = False):
+        self.fixtures_dir = fixtures_dir
+        self.realtime = realtime
+        self._records = {}
+
+    def get(self, url: str, params: dict) -> dict:
+        path = _fixture_path(self.fixtures_dir, url, params)
+
+        record = self._records.get(path)
+        if record is None:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                raise requests.exceptions.ConnectionError(f"Нет записи ответа для {url}: {e}")
+            self._records[path] = record
+
+        # В режиме реального времени повторяем исходную задержку ответа
+        if self.realtime:
+            time.sleep(record['elapsed'])
+
+        return record['body']
+
+
+def create_transport():
+    """Транспорт по настройке WEATHER_TRANSPORT"""
+    if WEATHER_TRANSPORT == 'record':
+        return RecordingTransport(HttpTransport(), WEATHER_FIXTURES_DIR)
+    if WEATHER_TRANSPORT == 'replay':
+        return ReplayTransport(WEATHER_FIXTURES_DIR, realtime=WEATHER_REPLAY_REALTIME)
+    return HttpTransport()
+
+
+# Транспорт для запросов к Telegram Bot API
+def create_telegram_request() -> HTTPXRequest:
+    """Общий пул соединений с Bot API; тайм-ауты по умолчанию — интерактивные"""
+    http_version = '2' if TELEGRAM_HTTP2 and HTTP2_AVAILABLE else '1.1'
+    if TELEGRAM_HTTP2 and not HTTP2_AVAILABLE:
+        logger.warning("Пакет h2 не установлен, запросы к Telegram идут по HTTP/1.1")
+
+    return HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        http_version=http_version,
+        **INTERACTIVE_TIMEOUTS,
+        # Держим открытыми все соединения пула, а не 20 по умолчанию в httpx
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=TELEGRAM_POOL_SIZE,
+                max_keepalive_connections=TELEGRAM_POOL_SIZE,
+                keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY
+            )
+        }
+    )
+
+
 # Класс для работы с погодой
 class WeatherService:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_ttl: int = CACHE_TTL, transport=None):
         self.api_key = api_key
+        self.transport = transport or HttpTransport()
         self.base_url = "http://api.openweathermap.org/data/2.5/weather"
         self.forecast_url = "http://api.openweathermap.org/data/2.5/forecast"
+        self.air_pollution_url = "http://api.openweathermap.org/data/2.5/air_pollution"
+        self.geocoding_url = "http://api.openweathermap.org/geo/1.0/direct"
+        self.cache_ttl = cache_ttl
+        # Время жизни записей кэша по виду данных (префикс ключа)
+        self.cache_ttls = {
+            'weather': cache_ttl,
+            'forecast': FORECAST_CACHE_TTL,
+            'air_pollution': AIR_POLLUTION_CACHE_TTL
+        }
+        # Кэш ответов: ключ -> {'data': ответ API, 'dt': время наблюдения, 'fetched_at': время загрузки}
+        self._cache = {}
+        # Время последнего успешного и неудачного запроса к API
+        self.last_success_at = None
+        self.last_failure_at = None
+        # Отдельный ограниченный пул для частей полного отчёта
+        self._report_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix='report')
+        # Выполняющиеся запросы: ключ кэша -> Future, которого ждут одновременные промахи
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _ttl(self, key: str) -> int:
+        """Время жизни записи кэша"""
+        return self.cache_ttls.get(key.split(':', 1)[0], self.cache_ttl)
+
+    def _fetch(self, key: str, url: str, params: dict) -> dict:
+        """Запрос к API с учётом кэша; одновременные промахи по ключу ждут один запрос"""
+        with self._inflight_lock:
+            entry = self._cache.get(key)
+            if entry and time.time() - entry['fetched_at'] < self._ttl(key):
+                return entry['data']
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            data = self.transport.get(url, params)
+            self.last_success_at = time.time()
+            self._cache[key] = {'data': data, 'dt': self._observation_dt(data), 'fetched_at': time.time()}
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            if isinstance(e, requests.exceptions.RequestException):
+                self.last_failure_at = time.time()
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def is_fresh(self, key: str) -> bool:
+        """Есть ли в кэше непросроченная запись"""
+        entry = self._cache.get(key)
+        return bool(entry) and time.time() - entry['fetched_at'] < self._ttl(key)
+
+    @staticmethod
+    def _observation_dt(data: dict) -> int:
+        """Время наблюдения из ответа API"""
+        return data['list'][0]['dt'] if 'list' in data else data['dt']
+
+    def save_snapshot(self, path: str):
+        """Сохранение кэша в файл"""
+        snapshot = dict(self._cache)
+        tmp_path = f"{path}.tmp"
+
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Ошибка при сохранении кэша: %s", e)
+
+    def load_snapshot(self, path: str) -> int:
+        """Загрузка кэша из файла, устаревшие и повреждённые записи пропускаются"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error("Ошибка при загрузке кэша: %s", e)
+            return 0
+
+        now = time.time()
+        loaded = 0
+        for key, entry in snapshot.items():
+            try:
+                age = now - entry['fetched_at']
+                fresh = 0 <= age < self._ttl(key) and entry['dt'] == self._observation_dt(entry['data'])
+            except (KeyError, IndexError, TypeError):
+                fresh = False
+
+            if fresh:
+                self._cache[key] = entry
+                loaded += 1
+
+        return loaded
 
     def get_current_weather(self, city_name: str) -> Optional[dict]:
         """Получение текущей погоды для города"""
@@ -85,22 +755,53 @@ class WeatherService:
                 'lat': city_data['lat'],
                 'lon': city_data['lon'],
                 'appid': self.api_key,
-                'units': 'metric',
-                'lang': 'ru'
+                'units': 'metric'
             }
 
-            response = requests.get(self.base_url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = self._fetch(f"weather:{city_name}", self.base_url, params)
 
             return self._format_weather_data(data, city_name)
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении погоды: {e}")
+            logger.error("Ошибка при получении погоды: %s", e)
             return None
 
-    def get_daily_forecast(self, city_name: str) -> Optional[str]:
+    def geocode(self, query: str) -> Optional[dict]:
+        """Координаты города по названию (ошибки запроса пробрасываются, результат не кэшируется)"""
+        params = {
+            'q': query,
+            'limit': 1,
+            'appid': self.api_key
+        }
+
+        try:
+            results = self.transport.get(self.geocoding_url, params)
+        except requests.exceptions.RequestException:
+            self.last_failure_at = time.time()
+            raise
+        self.last_success_at = time.time()
+
+        if not results:
+            return None
+
+        place = results[0]
+        local_names = place.get('local_names') or {}
+        return {
+            'name': local_names.get('ru', place['name']),
+            'name_en': local_names.get('en', place['name']),
+            'lat': place['lat'],
+            'lon': place['lon']
+        }
+
+    def get_daily_forecast(self, city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
         """Получение прогноза на день"""
+        entry = self.get_forecast_entry(city_name)
+        if not entry:
+            return None
+        return self._format_forecast_data(entry['data'], city_name, lang, units)
+
+    def get_forecast_entry(self, city_name: str) -> Optional[dict]:
+        """Прогноз на день в виде записи кэша (ответ API, dt и время загрузки)"""
         try:
             city_data = CITIES.get(city_name)
             if not city_data:
@@ -111,58 +812,490 @@ class WeatherService:
                 'lon': city_data['lon'],
                 'appid': self.api_key,
                 'units': 'metric',
-                'lang': 'ru',
                 'cnt': 8  # 8 периодов = 24 часа
             }
 
-            response = requests.get(self.forecast_url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            self._fetch(f"forecast:{city_name}", self.forecast_url, params)
+
+            return self._cache.get(f"forecast:{city_name}")
+
+        except requests.exceptions.RequestException as e:
+            logger.error("Ошибка при получении прогноза: %s", e)
+            return None
+
+    def get_air_pollution(self, city_name: str) -> Optional[dict]:
+        """Получение качества воздуха для города"""
+        try:
+            city_data = CITIES.get(city_name)
+            if not city_data:
+                return None
+
+            params = {
+                'lat': city_data['lat'],
+                'lon': city_data['lon'],
+                'appid': self.api_key
+            }
+
+            data = self._fetch(f"air_pollution:{city_name}", self.air_pollution_url, params)
 
-            return self._format_forecast_data(data, city_name)
+            item = data['list'][0]
+            return {
+                'aqi': item['main']['aqi'],
+                'pm2_5': item['components'].get('pm2_5'),
+                'pm10': item['components'].get('pm10')
+            }
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении прогноза: {e}")
+            logger.error("Ошибка при получении качества воздуха: %s", e)
+            return None
+
+    async def get_composite_report(self, city_name: str, lang: str = 'ru', units: str = 'metric',
+                                   timeout: float = REPORT_PART_TIMEOUT) -> dict:
+        """Текущая погода, прогноз и качество воздуха: запросы идут параллельно"""
+        parts = {
+            'weather': (self.get_current_weather, city_name),
+            'forecast': (self.get_daily_forecast, city_name, lang, units),
+            'air_pollution': (self.get_air_pollution, city_name)
+        }
+        loop = asyncio.get_running_loop()
+        tasks = {
+            name: loop.run_in_executor(self._report_executor, functools.partial(self._report_part, *call))
+            for name, call in parts.items()
+        }
+
+        # Отчёт ждёт не дольше timeout; опоздавшие запросы завершатся в фоне
+        # и попадут в кэш к следующему отчёту
+        done, _ = await asyncio.wait(tasks.values(), timeout=timeout)
+
+        return {
+            name: task.result() if task in done else None
+            for name, task in tasks.items()
+        }
+
+    @staticmethod
+    def _report_part(func, *args):
+        """Часть отчёта: любая ошибка (в том числе в разборе ответа) означает, что части нет"""
+        try:
+            return func(*args)
+        except Exception:
+            logger.exception("Ошибка в части отчёта %s", func.__name__)
+            return None
+
+    def get_cache_entry(self, key: str) -> Optional[dict]:
+        """Запись кэша без запроса к API"""
+        return self._cache.get(key)
+
+    def get_cached_weather(self, city_name: str) -> Optional[dict]:
+        """Текущая погода только из кэша, без запроса к API"""
+        entry = self._cache.get(f"weather:{city_name}")
+        if not entry:
+            return None
+        return self._format_weather_data(entry['data'], city_name)
+
+    def get_cached_forecast(self, city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+        """Прогноз только из кэша, без запроса к API"""
+        entry = self._cache.get(f"forecast:{city_name}")
+        if not entry:
             return None
+        return self._format_forecast_data(entry['data'], city_name, lang, units)
 
     def _format_weather_data(self, data: dict, city_name: str) -> dict:
-        """Форматирование данных о погоде"""
+        """Данные о погоде в канонических единицах (°C, гПа, м/с), без локализации"""
         main = data['main']
         weather = data['weather'][0]
         wind = data['wind']
 
         return {
             'city': city_name,
-            'temperature': round(main['temp']),
-            'feels_like': round(main['feels_like']),
-            'description': weather['description'].capitalize(),
+            'temperature': main['temp'],
+            'feels_like': main['feels_like'],
+            'condition_id': weather['id'],
+            'description': weather['description'],
             'humidity': main['humidity'],
-            'pressure': round(main['pressure'] * 0.750062),
+            'pressure': main['pressure'],
             'wind_speed': wind['speed'],
             'wind_gust': wind.get('gust', 0),
             'icon': weather['icon'],
-            'timestamp': datetime.fromtimestamp(data['dt'])
+            'timestamp': datetime.fromtimestamp(data['dt']),
+            'sunrise': datetime.fromtimestamp(data['sys']['sunrise']),
+            'sunset': datetime.fromtimestamp(data['sys']['sunset'])
         }
 
-    def _format_forecast_data(self, data: dict, city_name: str) -> str:
+    def _format_forecast_data(self, data: dict, city_name: str, lang: str = 'ru', units: str = 'metric') -> str:
         """Форматирование прогноза"""
-        forecast_text = f"📅 Прогноз погоды в {city_name} на 24 часа:\n\n"
+        title = LABELS[lang]['forecast_title'].format(city=city_title(city_name, lang))
+        forecast_text = f"📅 {title}:\n\n"
 
         for item in data['list'][::2]:  # Каждые 6 часов
             time_str = datetime.fromtimestamp(item['dt']).strftime('%H:%M')
-            temp = round(item['main']['temp'])
-            desc = item['weather'][0]['description'].capitalize()
+            temp = round(convert_temperature(item['main']['temp'], units))
+            weather = item['weather'][0]
+            desc = describe_condition(weather['id'], lang, weather['description'])
 
-            forecast_text += f"🕐 {time_str}: {temp}°C, {desc}\n"
+            forecast_text += f"🕐 {time_str}: {temp}{temperature_unit(units)}, {desc}\n"
 
         return forecast_text
 
 
+# Параллельная обработка обновлений
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата"""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> [блокировка чата, число обновлений чата в обработке]
+        self._chat_locks = {}
+
+    async def process_update(self, update, coroutine):
+        """Сначала блокировка чата, затем слот: очередь одного чата не держит слоты других чатов"""
+        # Базовый process_update берёт слот до блокировки чата, поэтому он переопределён
+        chat = getattr(update, 'effective_chat', None)
+        # Обновления без чата (инлайн-запросы) порядка не требуют
+        if chat is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        entry = self._chat_locks.get(chat.id)
+        if entry is None:
+            entry = self._chat_locks[chat.id] = [asyncio.Lock(), 0]
+
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            # Блокировки живут только пока у чата есть обновления в обработке
+            if entry[1] == 0:
+                del self._chat_locks[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# Ограничение частоты запросов
+class RateLimiter:
+    """Token bucket на пользователя в LRU ограниченного размера"""
+
+    def __init__(self, rate: float, burst: int, max_users: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        # user_id -> [токены, время обновления, уведомлён ли об ограничении]
+        self._buckets = OrderedDict()
+
+    def allow(self, user_id: int) -> bool:
+        """Списать токен; False, если запрос нужно ограничить"""
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+
+        if bucket is None:
+            bucket = [self.burst, now, False]
+            self._buckets[user_id] = bucket
+            # Вытесняем самого давнего пользователя: память не растёт с аудиторией
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True
+        return False
+
+    def first_rejection(self, user_id: int) -> bool:
+        """True только для первого ограниченного запроса подряд"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        return True
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_USERS)
+
+
 # Инициализация сервиса погоды
-weather_service = WeatherService(OPENWEATHER_API_KEY)
+weather_service = WeatherService(OPENWEATHER_API_KEY, transport=create_transport())
+
+# Собственный пул потоков для запросов к API и отрисовки: пул asyncio по умолчанию
+# (min(32, cpu + 4) потоков) ограничивал бы MAX_CONCURRENT_UPDATES
+weather_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPDATES, thread_name_prefix='weather')
+
+
+async def run_blocking(func, *args):
+    """Выполнение блокирующей функции в пуле weather_executor"""
+    return await asyncio.get_running_loop().run_in_executor(weather_executor, functools.partial(func, *args))
+
+
+async def fetch_current_weather(city_name: str) -> Optional[dict]:
+    """Текущая погода: свежий кэш прямо в цикле событий, иначе запрос в пуле потоков"""
+    if weather_service.is_fresh(f"weather:{city_name}"):
+        return weather_service.get_cached_weather(city_name)
+    return await run_blocking(weather_service.get_current_weather, city_name)
+
+
+async def fetch_daily_forecast(city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+    """Прогноз на день: свежий кэш прямо в цикле событий, иначе запрос в пуле потоков"""
+    if weather_service.is_fresh(f"forecast:{city_name}"):
+        return weather_service.get_cached_forecast(city_name, lang, units)
+    return await run_blocking(weather_service.get_daily_forecast, city_name, lang, units)
+
+
+# Геокодирование городов вне индекса
+class Geocoder:
+    """Поиск города через OpenWeather с ограниченным постоянным кэшем на диске"""
+
+    def __init__(self, service: WeatherService, path: str,
+                 max_places: int = GEOCODE_MAX_PLACES, max_misses: int = GEOCODE_MAX_MISSES,
+                 miss_ttl: int = GEOCODE_MISS_TTL):
+        self.service = service
+        self.path = path
+        self.max_places = max_places
+        self.max_misses = max_misses
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Нормализованный запрос -> {'name', 'name_en', 'lat', 'lon'} в порядке добавления
+        self._places = {}
+        # Нормализованный запрос -> время промаха, вытесняются давние
+        self._misses = OrderedDict()
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                cache = json.load(f)
+            places, misses = cache['places'], cache['misses']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Ошибка при загрузке кэша геокодирования: %s", e)
+            return
+
+        self._places = dict(list(places.items())[:self.max_places])
+        now = time.time()
+        for key, missed_at in sorted(misses.items(), key=lambda item: item[1]):
+            if now - missed_at < self.miss_ttl:
+                self._misses[key] = missed_at
+        while len(self._misses) > self.max_misses:
+            self._misses.popitem(last=False)
+
+    def save(self):
+        """Сохранение кэша в файл, если он изменился (из периодической задачи и при остановке)"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                cache = {'places': dict(self._places), 'misses': dict(self._misses)}
+                self._dirty = False
+
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(cache, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error("Ошибка при сохранении кэша геокодирования: %s", e)
+
+    def places(self) -> list:
+        """Найденные ранее города в порядке добавления"""
+        with self._lock:
+            return list(self._places.values())
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """Город по запросу: из кэша или, при первом запросе, через API"""
+        key = normalize_city(query)
+        if not key:
+            return None
+
+        with self._lock:
+            if key in self._places:
+                return self._places[key]
+            missed_at = self._misses.get(key)
+            if missed_at is not None and time.time() - missed_at < self.miss_ttl:
+                return None
+
+        place = self.service.geocode(query)
+
+        with self._lock:
+            if place is None:
+                self._misses[key] = time.time()
+                self._misses.move_to_end(key)
+                while len(self._misses) > self.max_misses:
+                    self._misses.popitem(last=False)
+            elif len(self._places) < self.max_places:
+                self._places[key] = place
+            self._dirty = True
+        return place
+
+
+geocoder = Geocoder(weather_service, GEOCODE_CACHE_PATH)
+# Города, добавленные геокодированием (не больше GEOCODE_MAX_PLACES)
+geocoded_cities = set()
+
+
+def is_same_place(city_data: dict, place: dict) -> bool:
+    """Совпадают ли координаты с точностью до ~10 км"""
+    return abs(city_data['lat'] - place['lat']) < 0.1 and abs(city_data['lon'] - place['lon']) < 0.1
+
+
+def register_city(place: dict) -> Optional[str]:
+    """Добавление найденного города в список городов и индекс поиска, возвращает его название"""
+    city_name = place['name']
+    suffix = ''
+    existing = CITIES.get(city_name)
+    if existing and not is_same_place(existing, place):
+        # Одноимённый город в другом месте различаем по координатам
+        suffix = f" ({place['lat']:.2f}, {place['lon']:.2f})"
+        city_name += suffix
+        existing = CITIES.get(city_name)
+
+    if existing:
+        return city_name
+
+    if len(geocoded_cities) >= GEOCODE_MAX_PLACES:
+        logger.warning("Достигнут предел городов из геокодирования, %s не добавлен", city_name)
+        return None
+
+    geocoded_cities.add(city_name)
+    CITIES[city_name] = {'lat': place['lat'], 'lon': place['lon']}
+    name_en = f"{place.get('name_en') or place['name']}{suffix}"
+    CITY_NAMES.setdefault(city_name, {'en': name_en})
+    city_index.add(city_name, (name_en,))
+    return city_name
+
+
+def match_city(text: str) -> Optional[str]:
+    """Город по свободному тексту только по локальному индексу, без запросов к API.
+    Принимаются точные названия, синонимы, транслитерации и очень близкие совпадения"""
+    return city_index.search(text)
+
+
+async def resolve_city(text: str) -> Optional[str]:
+    """Город по свободному тексту: локальный индекс, при промахе геокодирование OpenWeather,
+    а если и оно ничего не нашло — ближайшее нечёткое совпадение из индекса"""
+    city_name = match_city(text)
+    if city_name or not normalize_city(text):
+        return city_name
+
+    # Слабое совпадение может оказаться другим городом (Симеиз и Симферополь),
+    # поэтому сначала спрашиваем геокодирование
+    try:
+        place = await run_blocking(geocoder.lookup, text)
+    except requests.exceptions.RequestException as e:
+        logger.error("Ошибка при геокодировании: %s", e)
+        place = None
+
+    if not place:
+        return city_index.search(text, FUZZY_MATCH_THRESHOLD)
+
+    # Индекс и список городов меняются только в цикле событий
+    return register_city(place)
 
 
 # Функции бота
+def log_handler(handler):
+    """Журналирование обновления после обработки: чат, обработчик, задержка ответа"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.monotonic()
+        try:
+            return await handler(update, context)
+        finally:
+            user = update.effective_user
+            message = update.effective_message
+            logger.info(
+                "Пользователь %s отправил: %s",
+                user.first_name if user else None,
+                message.text if message else None,
+                extra={
+                    'chat_id': update.effective_chat.id if update.effective_chat else None,
+                    'handler': handler.__name__,
+                    'latency': round(time.monotonic() - started, 3),
+                    'sampled': True
+                }
+            )
+
+    return wrapper
+
+
+def get_user_locale(context: ContextTypes.DEFAULT_TYPE) -> tuple:
+    """Язык и система единиц пользователя"""
+    user_data = context.user_data or {}
+    return user_data.get('lang', 'ru'), user_data.get('units', 'metric')
+
+
+def get_cached_answer(message_text: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+    """Ответ на запрос погоды или прогноза из кэша, без запроса к API"""
+    if message_text.startswith("🌤️ "):
+        return get_cached_weather_message(message_text.replace("🌤️ ", ""), lang, units)
+
+    if message_text.startswith("/weather") and len(message_text.split()) > 1:
+        return get_cached_weather_message(message_text.split(maxsplit=1)[1], lang, units)
+
+    if message_text.startswith("📅 ") and message_text.endswith(" прогноз"):
+        return weather_service.get_cached_forecast(message_text[2:].replace(" прогноз", ""), lang, units)
+
+    if message_text.startswith("/forecast") and len(message_text.split()) > 1:
+        city_name = match_city(message_text.split(maxsplit=1)[1])
+        return weather_service.get_cached_forecast(city_name, lang, units) if city_name else None
+
+    return None
+
+
+async def send_typing(update: Update, *cache_keys: str):
+    """Статус «печатает…», если для ответа понадобится запрос к API"""
+    if SKIP_CACHED_CHAT_ACTION and all(weather_service.is_fresh(key) for key in cache_keys):
+        return
+    await update.message.reply_chat_action(action="typing")
+
+
+def get_cached_weather_message(city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+    """Сообщение с погодой из кэша"""
+    city_name = match_city(city_name)
+    weather_data = weather_service.get_cached_weather(city_name) if city_name else None
+    if not weather_data:
+        return None
+    return render_weather_data(weather_data, lang, units)
+
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ограничение частоты запросов пользователя перед остальными обработчиками"""
+    # Инлайн-запросы приходят на каждое нажатие клавиши и отвечаются только из кэша
+    # (фоновые обновления ограничены отдельно), поэтому их не ограничиваем и не отбрасываем
+    if update.inline_query:
+        return
+
+    user = update.effective_user
+    if user is None or rate_limiter.allow(user.id):
+        return
+
+    # Ограниченный запрос не порождает новой работы: один ответ из кэша
+    # или короткое уведомление на серию, остальные запросы отбрасываются
+    message = update.message
+    if message and message.text and rate_limiter.first_rejection(user.id):
+        answer = get_cached_answer(message.text, *get_user_locale(context))
+        if answer:
+            await message.reply_text(answer, parse_mode='HTML', reply_markup=get_main_keyboard())
+        else:
+            await message.reply_text("⏳ Слишком много запросов. Попробуйте чуть позже.")
+
+    raise ApplicationHandlerStop
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     welcome_text = """
@@ -207,11 +1340,17 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
    - /start - Перезапустить бота
    - /weather - Получить погоду (текстовый ввод)
    - /forecast - Получить прогноз
+   - /report - Полный отчёт: погода, воздух, восход и закат, прогноз
+   - /lang ru|en - Язык сводок погоды
+   - /units metric|imperial - Единицы измерения
    - /help - Эта справка
 
 Примеры текстовых команд:
 /weather Севастополь
 /forecast Симферополь
+/report Севастополь
+/weather Sevastopol
+/weather Ялта
     """
 
     await update.message.reply_text(help_text, reply_markup=get_main_keyboard())
@@ -220,16 +1359,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений и нажатий кнопок"""
     message_text = update.message.text
-    user = update.message.from_user
-
-    logger.info(f"Пользователь {user.first_name} отправил: {message_text}")
 
     # Обработка кнопок с погодой
     if message_text == "🌤️ Севастополь":
-        await send_weather(update, "Севастополь")
+        await send_weather(update, context, "Севастополь")
 
     elif message_text == "🌤️ Симферополь":
-        await send_weather(update, "Симферополь")
+        await send_weather(update, context, "Симферополь")
 
     # Обработка прогноза
     elif message_text == "📅 Прогноз на день":
@@ -239,10 +1375,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     elif message_text == "📅 Севастополь прогноз":
-        await send_forecast(update, "Севастополь")
+        await send_forecast(update, context, "Севастополь")
 
     elif message_text == "📅 Симферополь прогноз":
-        await send_forecast(update, "Симферополь")
+        await send_forecast(update, context, "Симферополь")
 
     # Обработка рассылки
     elif message_text == "⚙️ Настроить рассылку":
@@ -255,16 +1391,16 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     elif message_text == "⏰ Севастополь в 8:00":
-        await setup_schedule(update, 8, 0, "Севастополь")
+        await setup_schedule(update, context, 8, 0, "Севастополь")
 
     elif message_text == "⏰ Симферополь в 8:00":
-        await setup_schedule(update, 8, 0, "Симферополь")
+        await setup_schedule(update, context, 8, 0, "Симферополь")
 
     elif message_text == "⏰ Оба города в 9:00":
-        await setup_schedule(update, 9, 0, "Оба")
+        await setup_schedule(update, context, 9, 0, "Оба")
 
     elif message_text == "⏰ Оба города в 12:00":
-        await setup_schedule(update, 12, 0, "Оба")
+        await setup_schedule(update, context, 12, 0, "Оба")
 
     elif message_text == "❌ Остановить рассылку":
         await stop_schedule_command(update, context)
@@ -279,8 +1415,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Обработка текстовой команды /weather
     elif message_text.startswith("/weather"):
         if len(message_text.split()) > 1:
-            city = message_text.split()[1]
-            await send_weather(update, city)
+            city = message_text.split(maxsplit=1)[1]
+            await send_weather(update, context, city)
         else:
             await update.message.reply_text(
                 "Укажите город: /weather Севастополь",
@@ -290,8 +1426,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Обработка текстовой команды /forecast
     elif message_text.startswith("/forecast"):
         if len(message_text.split()) > 1:
-            city = message_text.split()[1]
-            await send_forecast(update, city)
+            city = message_text.split(maxsplit=1)[1]
+            await send_forecast(update, context, city)
         else:
             await update.message.reply_text(
                 "Укажите город: /forecast Севастополь",
@@ -308,23 +1444,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def send_weather(update: Update, city_name: str):
+async def send_weather(update: Update, context: ContextTypes.DEFAULT_TYPE, city_name: str):
     """Отправка погоды для указанного города"""
-    city_name = city_name.capitalize()
+    city_name = await resolve_city(city_name)
 
-    if city_name not in CITIES:
+    if not city_name:
         await update.message.reply_text(
-            "Доступные города: Севастополь, Симферополь",
+            "Город не найден. Например: Севастополь, Симферополь",
             reply_markup=get_main_keyboard()
         )
         return
 
-    await update.message.reply_chat_action(action="typing")
+    await send_typing(update, f"weather:{city_name}")
 
-    weather_data = weather_service.get_current_weather(city_name)
+    weather_data = await fetch_current_weather(city_name)
 
     if weather_data:
-        message = format_weather_message(weather_data)
+        message = render_weather_data(weather_data, *get_user_locale(context))
         await update.message.reply_text(
             message,
             parse_mode='HTML',
@@ -337,26 +1473,37 @@ async def send_weather(update: Update, city_name: str):
         )
 
 
-async def send_forecast(update: Update, city_name: str):
+async def send_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE, city_name: str):
     """Отправка прогноза для указанного города"""
-    city_name = city_name.replace(" прогноз", "").capitalize()
+    city_name = await resolve_city(city_name.replace(" прогноз", ""))
 
-    if city_name not in CITIES:
+    if not city_name:
         await update.message.reply_text(
-            "Доступные города: Севастополь, Симферополь",
+            "Город не найден. Например: Севастополь, Симферополь",
             reply_markup=get_forecast_keyboard()
         )
         return
 
-    await update.message.reply_chat_action(action="typing")
+    await send_typing(update, f"forecast:{city_name}")
 
-    forecast = weather_service.get_daily_forecast(city_name)
+    lang, units = get_user_locale(context)
+    forecast = await fetch_daily_forecast(city_name, lang, units)
 
     if forecast:
-        await update.message.reply_text(
+        sent = await send_forecast_chart(
+            update.get_bot(),
+            update.message.chat_id,
+            city_name,
             forecast,
+            lang,
+            units,
             reply_markup=get_main_keyboard()
         )
+        if not sent:
+            await update.message.reply_text(
+                forecast,
+                reply_markup=get_main_keyboard()
+            )
     else:
         await update.message.reply_text(
             "Не удалось получить прогноз. Попробуйте позже.",
@@ -364,7 +1511,87 @@ async def send_forecast(update: Update, city_name: str):
         )
 
 
-def format_weather_message(weather_data: dict) -> str:
+# Графики прогноза: (город, язык, единицы) -> ((dt прогноза, время загрузки), file_id в Telegram)
+forecast_charts = {}
+forecast_chart_locks = {}
+
+
+def render_forecast_chart(data: dict, city_name: str, lang: str = 'ru', units: str = 'metric') -> bytes:
+    """PNG-график температуры и осадков по прогнозу"""
+    labels = LABELS[lang]
+    times = [datetime.fromtimestamp(item['dt']) for item in data['list']]
+    temps = [convert_temperature(item['main']['temp'], units) for item in data['list']]
+    precipitation = [
+        item.get('rain', {}).get('3h', 0) + item.get('snow', {}).get('3h', 0)
+        for item in data['list']
+    ]
+
+    figure = Figure(figsize=(8, 4), dpi=100)
+    temp_axis = figure.add_subplot()
+    precipitation_axis = temp_axis.twinx()
+
+    precipitation_axis.bar(times, precipitation, width=0.1, color='tab:blue', alpha=0.3)
+    precipitation_axis.set_ylabel(labels['precipitation'])
+    precipitation_axis.set_ylim(bottom=0)
+
+    temp_axis.plot(times, temps, color='tab:red', marker='o')
+    temp_axis.set_ylabel(f"{labels['temperature']}, {temperature_unit(units)}")
+    temp_axis.xaxis.set_major_formatter(DateFormatter('%H:%M'))
+    temp_axis.set_zorder(precipitation_axis.get_zorder() + 1)
+    temp_axis.patch.set_visible(False)
+    temp_axis.set_title(labels['forecast_title'].format(city=city_title(city_name, lang)))
+
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def get_cached_chart(city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+    """file_id графика, если он построен по текущему прогнозу из кэша"""
+    entry = weather_service.get_cache_entry(f"forecast:{city_name}")
+    cached = forecast_charts.get((city_name, lang, units))
+    if entry and cached and cached[0] == (entry['dt'], entry['fetched_at']):
+        return cached[1]
+    return None
+
+
+async def send_forecast_chart(bot, chat_id: int, city_name: str, caption: str,
+                              lang: str = 'ru', units: str = 'metric', **kwargs) -> bool:
+    """Отправка графика прогноза: рендер и загрузка один раз, далее по file_id"""
+    if Figure is None:
+        return False
+
+    # Ошибка отправки графика не оставляет пользователя без ответа: прогноз уйдёт текстом
+    try:
+        file_id = get_cached_chart(city_name, lang, units)
+        if file_id:
+            await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, **kwargs)
+            return True
+
+        # Один рендер и одна загрузка на прогноз, даже при одновременных запросах
+        chart_key = (city_name, lang, units)
+        async with forecast_chart_locks.setdefault(chart_key, asyncio.Lock()):
+            file_id = get_cached_chart(city_name, lang, units)
+            if file_id:
+                await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, **kwargs)
+                return True
+
+            entry = await run_blocking(weather_service.get_forecast_entry, city_name)
+            if not entry:
+                return False
+
+            png = await run_blocking(render_forecast_chart, entry['data'], city_name, lang, units)
+            message = await bot.send_photo(chat_id=chat_id, photo=png, caption=caption, **kwargs)
+
+            # Новый прогноз в кэше погоды даёт новую версию и заменяет старый график
+            forecast_charts[chart_key] = ((entry['dt'], entry['fetched_at']), message.photo[-1].file_id)
+            return True
+    except TelegramError as e:
+        logger.error("Ошибка при отправке графика прогноза: %s", e)
+        return False
+
+
+def format_weather_message(weather_data: dict, lang: str = 'ru', units: str = 'metric') -> str:
     """Форматирование сообщения с погодой"""
     emoji_map = {
         '01': '☀️',  # ясно
@@ -381,54 +1608,300 @@ def format_weather_message(weather_data: dict) -> str:
     icon = weather_data['icon'][:2]
     emoji = emoji_map.get(icon, '🌡️')
 
+    labels = LABELS[lang]
+    values = localize_weather(weather_data, lang, units)
+
     return f"""
-{emoji} <b>Погода в {weather_data['city']}</b>
-📅 {weather_data['timestamp'].strftime('%d.%m.%Y %H:%M')}
+{emoji} <b>{labels['weather_title'].format(city=values['city'])}</b>
+📅 {values['timestamp']}
 
-🌡️ Температура: <b>{weather_data['temperature']}°C</b>
-🤔 Ощущается как: <b>{weather_data['feels_like']}°C</b>
-📝 {weather_data['description']}
+🌡️ {labels['temperature']}: <b>{values['temperature']}{values['temp_unit']}</b>
+🤔 {labels['feels_like']}: <b>{values['feels_like']}{values['temp_unit']}</b>
+📝 {values['description']}
 
-💧 Влажность: {weather_data['humidity']}%
-📊 Давление: {weather_data['pressure']} мм рт.ст.
-💨 Ветер: {weather_data['wind_speed']} м/с
-🌀 Порывы ветра: {weather_data['wind_gust']} м/с
+💧 {labels['humidity']}: {values['humidity']}%
+📊 {labels['pressure']}: {values['pressure']} {values['pressure_unit']}
+💨 {labels['wind']}: {values['wind_speed']} {values['speed_unit']}
+🌀 {labels['gust']}: {values['wind_gust']} {values['speed_unit']}
 """
 
 
+def format_composite_report(report: dict, lang: str = 'ru', units: str = 'metric') -> str:
+    """Полный отчёт: погода, восход и закат, качество воздуха, прогноз"""
+    labels = LABELS[lang]
+    sections = []
+
+    weather_data = report['weather']
+    if weather_data:
+        sections.append(format_weather_message(weather_data, lang, units).strip())
+        sections.append(
+            f"🌅 {labels['sunrise']}: {weather_data['sunrise'].strftime('%H:%M')}\n"
+            f"🌇 {labels['sunset']}: {weather_data['sunset'].strftime('%H:%M')}"
+        )
+
+    air = report['air_pollution']
+    if air:
+        level = labels['aqi_levels'][air['aqi'] - 1]
+        sections.append(
+            f"🍃 {labels['air_quality']}: {air['aqi']} ({level})\n"
+            f"PM2.5: {air['pm2_5']} {labels['concentration_unit']}, "
+            f"PM10: {air['pm10']} {labels['concentration_unit']}"
+        )
+
+    if report['forecast']:
+        sections.append(report['forecast'].strip())
+
+    if not all(report.values()):
+        sections.append(f"⚠️ {labels['part_unavailable']}")
+
+    return "\n\n".join(sections)
+
+
+async def send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, city_name: str):
+    """Отправка полного отчёта для указанного города"""
+    city_name = await resolve_city(city_name)
+
+    if not city_name:
+        await update.message.reply_text(
+            "Город не найден. Например: Севастополь, Симферополь",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    await send_typing(update, f"weather:{city_name}", f"air_pollution:{city_name}", f"forecast:{city_name}")
+
+    lang, units = get_user_locale(context)
+    report = await weather_service.get_composite_report(city_name, lang, units)
+
+    if any(report.values()):
+        await update.message.reply_text(
+            format_composite_report(report, lang, units),
+            parse_mode='HTML',
+            reply_markup=get_main_keyboard()
+        )
+    else:
+        await update.message.reply_text(
+            "Не удалось получить данные о погоде. Попробуйте позже.",
+            reply_markup=get_main_keyboard()
+        )
+
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Полный отчёт: погода, качество воздуха, восход и закат, прогноз"""
+    if not context.args:
+        await update.message.reply_text(
+            "Укажите город: /report Севастополь",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    await send_report(update, context, " ".join(context.args))
+
+
 # Функции для работы с рассылкой
-async def setup_schedule(update: Update, hour: int, minute: int, city: str):
+def is_valid_schedule_time(hour, minute) -> bool:
+    """Время рассылки в пределах суток"""
+    return isinstance(hour, int) and isinstance(minute, int) and 0 <= hour < 24 and 0 <= minute < 60
+
+
+def get_schedule_cities(city: str) -> list:
+    """Список городов для настройки рассылки"""
+    if city == "Оба":
+        return ["Севастополь", "Симферополь"]
+    return [city]
+
+
+def delivery_offset(chat_id: int) -> int:
+    """Смещение отправки внутри окна рассылки (детерминировано для чата)"""
+    if DELIVERY_WINDOW <= 0:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % DELIVERY_WINDOW
+
+
+# Заранее подготовленные сообщения: (город, язык, единицы) -> (время наблюдения, текст)
+rendered_messages = {}
+
+
+def render_weather_data(weather_data: dict, lang: str = 'ru', units: str = 'metric') -> str:
+    """Сообщение с погодой (рендерится один раз на наблюдение и локаль)"""
+    key = (weather_data['city'], lang, units)
+    cached = rendered_messages.get(key)
+    if cached and cached[0] == weather_data['timestamp']:
+        return cached[1]
+
+    message = format_weather_message(weather_data, lang, units)
+    rendered_messages[key] = (weather_data['timestamp'], message)
+    return message
+
+
+def render_weather_message(city_name: str, lang: str = 'ru', units: str = 'metric') -> Optional[str]:
+    """Сообщение с погодой для рассылки"""
+    weather_data = weather_service.get_current_weather(city_name)
+    if not weather_data:
+        return None
+    return render_weather_data(weather_data, lang, units)
+
+
+class BroadcastStore:
+    """Состояние рассылок на диске: подписки и прогресс запусков"""
+
+    def __init__(self, state_dir: str):
+        # Каталог создаётся при первой записи, а не при импорте модуля
+        self.state_dir = state_dir
+        # Открытые журналы прогресса: run_id -> файл
+        self._progress_files = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.state_dir, name)
+
+    def _write_json(self, name: str, data):
+        path = self._path(name)
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def load_subscriptions(self) -> dict:
+        """Сохранённые подписки (ключи schedule_*)"""
+        try:
+            with open(self._path('subscriptions.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_subscriptions(self, bot_data: dict):
+        """Сохранение подписок из bot_data"""
+        subscriptions = {key: value for key, value in bot_data.items() if key.startswith('schedule_')}
+        self._write_json('subscriptions.json', subscriptions)
+
+    def start_run(self, run_id: str, run: dict):
+        """Запись нового запуска: список получателей фиксируется один раз"""
+        self._write_json(f"run_{run_id}.json", run)
+
+    def load_runs(self) -> dict:
+        """Незавершённые запуски с курсором, восстановленным из журнала прогресса"""
+        runs = {}
+        if not os.path.isdir(self.state_dir):
+            return runs
+
+        for name in os.listdir(self.state_dir):
+            if not (name.startswith('run_') and name.endswith('.json')):
+                continue
+            run_id = name[len('run_'):-len('.json')]
+
+            with open(self._path(name), encoding='utf-8') as f:
+                run = json.load(f)
+            try:
+                with open(self._path(f"run_{run_id}.progress"), encoding='utf-8') as f:
+                    run['cursor'] = sum(1 for _ in f)
+            except FileNotFoundError:
+                run['cursor'] = 0
+
+            runs[run_id] = run
+        return runs
+
+    def mark_delivered(self, run_id: str):
+        """Отметка об обработке очередного получателя (дописывается в журнал)"""
+        progress = self._progress_files.get(run_id)
+        if progress is None:
+            progress = open(self._path(f"run_{run_id}.progress"), 'a', encoding='utf-8')
+            self._progress_files[run_id] = progress
+        progress.write("1\n")
+        progress.flush()
+
+    def finish_run(self, run_id: str):
+        """Удаление завершённого или просроченного запуска"""
+        progress = self._progress_files.pop(run_id, None)
+        if progress:
+            progress.close()
+
+        for name in (f"run_{run_id}.json", f"run_{run_id}.progress"):
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Закрытие журналов прогресса (запуски остаются для возобновления)"""
+        for progress in self._progress_files.values():
+            progress.close()
+        self._progress_files.clear()
+
+
+broadcast_store = BroadcastStore(BROADCAST_STATE_DIR)
+
+# Выполняющиеся рассылки (run_id -> (задача, запуск)) и признак остановки бота
+active_broadcasts = {}
+broadcast_stopping = asyncio.Event()
+
+
+def get_slot_subscriptions(bot_data: dict, hour: int, minute: int) -> list:
+    """Подписки на слот рассылки"""
+    return [
+        value for key, value in bot_data.items()
+        if key.startswith('schedule_') and value['hour'] == hour and value['minute'] == minute
+    ]
+
+
+def add_slot_jobs(scheduler, application, hour: int, minute: int):
+    """Задачи слота: подготовка погоды заранее и растянутая по окну рассылка"""
+    slot = f'{hour:02d}_{minute:02d}'
+
+    lead_hour, rest = divmod((hour * 3600 + minute * 60 - PRERENDER_LEAD) % 86400, 3600)
+    lead_minute, lead_second = divmod(rest, 60)
+    scheduler.add_job(
+        prerender_slot,
+        CronTrigger(hour=lead_hour, minute=lead_minute, second=lead_second),
+        args=[application, hour, minute],
+        id=f'prerender_{slot}',
+        name=f"Подготовка рассылки {hour:02d}:{minute:02d}",
+        replace_existing=True,
+        misfire_grace_time=PRERENDER_LEAD,
+        coalesce=True
+    )
+
+    scheduler.add_job(
+        broadcast_slot,
+        CronTrigger(hour=hour, minute=minute),
+        args=[application, hour, minute],
+        id=f'broadcast_{slot}',
+        name=f"Рассылка {hour:02d}:{minute:02d}",
+        replace_existing=True,
+        # Задача общая для всех подписчиков слота: опоздание цикла событий
+        # не должно отменять рассылку целиком
+        misfire_grace_time=BROADCAST_LATENESS,
+        coalesce=True
+    )
+
+
+async def setup_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, hour: int, minute: int, city: str):
     """Настройка рассылки через кнопку"""
-    # Сохраняем настройки в user_data
-    update.message.from_user
+    # Неверное время не сохраняем: задачу слота для него не создать
+    if not is_valid_schedule_time(hour, minute):
+        await update.message.reply_text(
+            "Пожалуйста, укажите корректное время: час от 0 до 23, минуты от 0 до 59",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    # Сохраняем настройки в bot_data
     schedule_key = f"schedule_{update.message.from_user.id}"
 
-    update.message.chat.bot_data[schedule_key] = {
+    context.bot_data[schedule_key] = {
         'hour': hour,
         'minute': minute,
         'city': city,
         'chat_id': update.message.chat_id,
-        'user_name': update.message.from_user.first_name
+        'user_name': update.message.from_user.first_name,
+        'lang': get_user_locale(context)[0],
+        'units': get_user_locale(context)[1]
     }
+    broadcast_store.save_subscriptions(context.bot_data)
 
-    # Настраиваем задачу в планировщике
-    scheduler = update.message.chat.bot.bot_data.get('scheduler')
+    # Настраиваем задачи слота в планировщике
+    scheduler = context.bot_data.get('scheduler')
     if scheduler:
-        # Удаляем старую задачу если есть
-        job_id = f'weather_schedule_{update.message.chat_id}'
-        try:
-            scheduler.remove_job(job_id)
-        except:
-            pass
-
-        # Добавляем новую задачу
-        scheduler.add_job(
-            send_scheduled_weather,
-            CronTrigger(hour=hour, minute=minute),
-            args=[update.message.chat.bot, schedule_key],
-            id=job_id,
-            name=f"Рассылка для {update.message.from_user.first_name}"
-        )
+        add_slot_jobs(scheduler, context.application, hour, minute)
 
     city_display = "оба города" if city == "Оба" else f"город {city}"
     await update.message.reply_text(
@@ -457,16 +1930,18 @@ async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         hour = int(context.args[0])
         minute = int(context.args[1])
-        city = context.args[2].capitalize() if len(context.args) > 2 else "Оба"
+        city = " ".join(context.args[2:]).capitalize() if len(context.args) > 2 else "Оба"
 
-        if city not in ["Севастополь", "Симферополь", "Оба"]:
+        if city != "Оба":
+            city = await resolve_city(city)
+        if not city:
             await update.message.reply_text(
-                "Доступные города: Севастополь, Симферополь или Оба",
+                "Город не найден. Например: Севастополь, Симферополь или Оба",
                 reply_markup=get_main_keyboard()
             )
             return
 
-        await setup_schedule(update, hour, minute, city)
+        await setup_schedule(update, context, hour, minute, city)
 
     except ValueError:
         await update.message.reply_text(
@@ -477,18 +1952,11 @@ async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stop_schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Остановка рассылки"""
-    scheduler = update.message.chat.bot.bot_data.get('scheduler')
-    if scheduler:
-        job_id = f'weather_schedule_{update.message.chat_id}'
-        try:
-            scheduler.remove_job(job_id)
-        except:
-            pass
-
-    # Удаляем настройки
+    # Удаляем настройки (задача слота общая и пропустит чат без подписки)
     schedule_key = f"schedule_{update.message.from_user.id}"
-    if schedule_key in update.message.chat.bot.bot_data:
-        del update.message.chat.bot.bot_data[schedule_key]
+    if schedule_key in context.bot_data:
+        del context.bot_data[schedule_key]
+        broadcast_store.save_subscriptions(context.bot_data)
 
     await update.message.reply_text(
         "✅ Рассылка остановлена",
@@ -496,25 +1964,120 @@ async def stop_schedule_command(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 
-async def send_scheduled_weather(bot, schedule_key: str):
-    """Отправка погоды по расписанию"""
-    schedule_data = bot.bot_data.get(schedule_key)
-    if not schedule_data:
+async def prerender_slot(application, hour: int, minute: int):
+    """Загрузка и рендер погоды для слота до начала рассылки"""
+    subscriptions = get_slot_subscriptions(application.bot_data, hour, minute)
+    renders = {
+        (city_name, data.get('lang', 'ru'), data.get('units', 'metric'))
+        for data in subscriptions
+        for city_name in get_schedule_cities(data['city'])
+    }
+
+    for city_name, lang, units in renders:
+        await run_blocking(render_weather_message, city_name, lang, units)
+
+
+async def broadcast_slot(application, hour: int, minute: int):
+    """Запуск рассылки слота с фиксацией списка получателей на диске"""
+    scheduled = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+    run_id = f"{scheduled:%Y%m%d_%H%M}"
+    if run_id in active_broadcasts:
         return
 
-    city = schedule_data['city']
-    chat_id = schedule_data['chat_id']
+    subscriptions = get_slot_subscriptions(application.bot_data, hour, minute)
+    subscriptions.sort(key=lambda data: delivery_offset(data['chat_id']))
+    run = {
+        'scheduled_at': scheduled.timestamp(),
+        'recipients': subscriptions,
+        'cursor': 0
+    }
+    broadcast_store.start_run(run_id, run)
 
-    if city == "Оба":
-        cities_to_send = ["Севастополь", "Симферополь"]
-    else:
-        cities_to_send = [city]
+    await deliver_run(application, run_id, run)
 
-    for city_name in cities_to_send:
-        weather_data = weather_service.get_current_weather(city_name)
-        if weather_data:
-            message = format_weather_message(weather_data)
-            await bot.send_message(chat_id=chat_id, text=message, parse_mode='HTML')
+
+async def deliver_run(application, run_id: str, run: dict):
+    """Рассылка по получателям начиная с курсора, каждому со своим смещением внутри окна"""
+    active_broadcasts[run_id] = (asyncio.current_task(), run)
+    try:
+        recipients = run['recipients']
+        while run['cursor'] < len(recipients):
+            schedule_data = recipients[run['cursor']]
+
+            delay = run['scheduled_at'] + delivery_offset(schedule_data['chat_id']) - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(broadcast_stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            # При остановке прогресс уже на диске: рассылка продолжится после перезапуска
+            if broadcast_stopping.is_set():
+                return
+
+            try:
+                await send_scheduled_weather(application.bot, schedule_data)
+            except TelegramError as e:
+                logger.error(
+                    "Ошибка рассылки: %s", e,
+                    extra={'chat_id': schedule_data['chat_id'], 'handler': 'deliver_run'}
+                )
+
+            run['cursor'] += 1
+            broadcast_store.mark_delivered(run_id)
+
+        broadcast_store.finish_run(run_id)
+    finally:
+        del active_broadcasts[run_id]
+
+
+async def resume_broadcasts(application):
+    """Возобновление прерванных рассылок после перезапуска"""
+    for run_id, run in broadcast_store.load_runs().items():
+        lateness = time.time() - run['scheduled_at']
+        if lateness > BROADCAST_LATENESS:
+            logger.warning("Рассылка %s опоздала на %.0f с и не будет продолжена", run_id, lateness)
+            broadcast_store.finish_run(run_id)
+            continue
+
+        logger.info("Продолжение рассылки %s с получателя %d из %d", run_id, run['cursor'], len(run['recipients']))
+        # Вызывается из post_init, до Application.start(), поэтому задача создаётся в asyncio
+        # и сразу попадает в active_broadcasts, откуда её дождётся drain_broadcasts
+        task = asyncio.create_task(deliver_run(application, run_id, run))
+        active_broadcasts[run_id] = (task, run)
+
+
+async def drain_broadcasts(application):
+    """Остановка рассылок: текущие отправки завершаются, прогресс сохраняется"""
+    scheduler = application.bot_data.get('scheduler')
+    if scheduler:
+        scheduler.shutdown(wait=False)
+
+    broadcast_stopping.set()
+    if active_broadcasts:
+        tasks = [task for task, _ in active_broadcasts.values()]
+        await asyncio.wait(tasks, timeout=BROADCAST_DRAIN_TIMEOUT)
+    broadcast_store.close()
+
+
+def broadcast_queue_depth() -> int:
+    """Сколько получателей ещё ждут отправки в выполняющихся рассылках"""
+    # Вызывается и из потока /health, пока цикл событий меняет словарь, поэтому по копии
+    return sum(len(run['recipients']) - run['cursor'] for _, run in list(active_broadcasts.values()))
+
+
+async def send_scheduled_weather(bot, schedule_data: dict):
+    """Отправка погоды по расписанию"""
+    chat_id = schedule_data['chat_id']
+
+    for city_name in get_schedule_cities(schedule_data['city']):
+        message = await run_blocking(
+            render_weather_message,
+            city_name,
+            schedule_data.get('lang', 'ru'),
+            schedule_data.get('units', 'metric')
+        )
+        if message:
+            await bot.send_message(chat_id=chat_id, text=message, parse_mode='HTML', **BULK_TIMEOUTS)
 
 
 # Команда для отправки в группу
@@ -530,22 +2093,22 @@ async def send_to_group_command(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     group_id = context.args[0]
-    city_name = context.args[1].capitalize()
+    city_name = await resolve_city(" ".join(context.args[1:]))
 
-    if city_name not in CITIES:
+    if not city_name:
         await update.message.reply_text(
-            "Доступные города: Севастополь, Симферополь",
+            "Город не найден. Например: Севастополь, Симферополь",
             reply_markup=get_main_keyboard()
         )
         return
 
-    await update.message.reply_chat_action(action="typing")
+    await send_typing(update, f"weather:{city_name}")
 
-    weather_data = weather_service.get_current_weather(city_name)
+    weather_data = await fetch_current_weather(city_name)
 
     if weather_data:
-        message = format_weather_message(weather_data)
-        await context.bot.send_message(chat_id=group_id, text=message, parse_mode='HTML')
+        message = render_weather_data(weather_data, *get_user_locale(context))
+        await context.bot.send_message(chat_id=group_id, text=message, parse_mode='HTML', **BULK_TIMEOUTS)
         await update.message.reply_text(
             f"✅ Погода отправлена в группу {group_id}",
             reply_markup=get_main_keyboard()
@@ -557,38 +2120,375 @@ async def send_to_group_command(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
 
+# Настройки языка и единиц
+async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор языка сводок погоды"""
+    if not context.args or context.args[0].lower() not in LANGUAGES:
+        await update.message.reply_text(
+            "Использование: /lang ru|en",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    context.user_data['lang'] = context.args[0].lower()
+    await update.message.reply_text(
+        f"✅ Язык сводок: {context.user_data['lang']}",
+        reply_markup=get_main_keyboard()
+    )
+
+
+async def units_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор системы единиц"""
+    if not context.args or context.args[0].lower() not in UNIT_SYSTEMS:
+        await update.message.reply_text(
+            "Использование: /units metric|imperial",
+            reply_markup=get_main_keyboard()
+        )
+        return
+
+    context.user_data['units'] = context.args[0].lower()
+    await update.message.reply_text(
+        f"✅ Единицы измерения: {context.user_data['units']}",
+        reply_markup=get_main_keyboard()
+    )
+
+
+# Инлайн-режим
+# Города, погода для которых сейчас обновляется в фоне
+background_refreshes = set()
+
+
+def refresh_weather_in_background(application, city_name: str):
+    """Фоновое обновление погоды (не более одного запроса на город)"""
+    if city_name in background_refreshes:
+        return
+    background_refreshes.add(city_name)
+
+    async def refresh():
+        try:
+            await run_blocking(weather_service.get_current_weather, city_name)
+        finally:
+            background_refreshes.discard(city_name)
+
+    application.create_task(refresh())
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Инлайн-запрос @bot <город>: ответ только из кэша, без запросов к API"""
+    query = update.inline_query.query.strip().lower()
+    lang, units = get_user_locale(context)
+    results = []
+    complete = True
+    refreshes = 0
+    # Нечёткое совпадение для запросов с опечатками и транслитом (без геокодирования)
+    matched = match_city(query)
+
+    for index, city_name in enumerate(CITIES):
+        if len(results) >= INLINE_MAX_RESULTS:
+            break
+
+        names = (city_name, *CITY_NAMES.get(city_name, {}).values())
+        if city_name != matched and not any(name.lower().startswith(query) for name in names):
+            continue
+
+        # Отсутствующие и устаревшие данные обновляем в фоне, ответ не ждёт API.
+        # Пустой запрос подходит ко всем городам, поэтому обновления только по введённому тексту
+        if not weather_service.is_fresh(f"weather:{city_name}"):
+            complete = False
+            if query and refreshes < INLINE_MAX_REFRESHES:
+                refreshes += 1
+                refresh_weather_in_background(context.application, city_name)
+
+        labels = LABELS[lang]
+        title = city_title(city_name, lang)
+
+        weather_data = weather_service.get_cached_weather(city_name)
+        if weather_data:
+            values = localize_weather(weather_data, lang, units)
+            results.append(InlineQueryResultArticle(
+                id=f"weather_{index}",
+                title=f"🌤️ {labels['weather_title'].format(city=title)}",
+                description=f"{values['temperature']}{values['temp_unit']}, {values['description']}",
+                input_message_content=InputTextMessageContent(
+                    render_weather_data(weather_data, lang, units),
+                    parse_mode='HTML'
+                )
+            ))
+
+        forecast = weather_service.get_cached_forecast(city_name, lang, units)
+        chart_file_id = get_cached_chart(city_name, lang, units)
+        if forecast and chart_file_id:
+            results.append(InlineQueryResultCachedPhoto(
+                id=f"forecast_{index}",
+                photo_file_id=chart_file_id,
+                title=f"📅 {labels['forecast_title'].format(city=title)}",
+                caption=forecast
+            ))
+        elif forecast:
+            results.append(InlineQueryResultArticle(
+                id=f"forecast_{index}",
+                title=f"📅 {labels['forecast_title'].format(city=title)}",
+                input_message_content=InputTextMessageContent(forecast)
+            ))
+
+    # Неполный ответ кэшируем ненадолго, чтобы повторный запрос получил свежие данные.
+    # Ответ зависит от языка и единиц пользователя, поэтому кэш персональный
+    await update.inline_query.answer(
+        results[:INLINE_MAX_RESULTS],
+        cache_time=INLINE_CACHE_TIME if complete else 5,
+        is_personal=True
+    )
+
+
+# Сторожевой таймер и проверка состояния
+class LoopWatchdog:
+    """Замер задержки цикла событий и захват стека при зависании"""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        # Отсчёт начинается с запуска run(): время инициализации бота зависанием не считается
+        self._heartbeat = None
+        self._loop_thread_id = None
+        # Задача run() и признак её завершения для потока наблюдения
+        self.task = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        """Задача в цикле событий: просыпается каждые interval и меряет опоздание"""
+        self.lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True).start()
+
+        try:
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self._heartbeat = time.monotonic()
+                self.lag = self._heartbeat - started - self.interval
+        finally:
+            self._stopped.set()
+            self._heartbeat = None
+
+    def start(self):
+        """Запуск задачи замера в текущем цикле событий"""
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановка задачи замера и потока наблюдения"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def current_lag(self) -> float:
+        """Задержка с учётом зависания, которое ещё продолжается"""
+        if self._heartbeat is None:
+            return 0.0
+        return max(self.lag, time.monotonic() - self._heartbeat - self.interval)
+
+    def _monitor(self):
+        """Поток наблюдения: при зависании цикла пишет в лог стек блокирующего кода"""
+        reported = False
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            if heartbeat is None:
+                continue
+            stalled = time.monotonic() - heartbeat - self.interval
+
+            if stalled < self.threshold:
+                reported = False
+            elif not reported:
+                reported = True
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame else ''
+                logger.warning("Цикл событий заблокирован %.1f с, стек:\n%s", stalled, stack)
+
+
+watchdog = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD)
+
+
+def get_health_status(application) -> dict:
+    """Состояние бота для /health и /ready"""
+    now = time.time()
+    loop_lag = watchdog.current_lag()
+    scheduler = application.bot_data.get('scheduler')
+    scheduler_running = bool(scheduler and scheduler.running)
+
+    last_success = weather_service.last_success_at
+    upstream_ok = weather_service.last_failure_at is None or (
+        last_success is not None and now - last_success < READY_MAX_FETCH_AGE
+    )
+
+    live = loop_lag < LOOP_STALL_THRESHOLD
+    return {
+        'live': live,
+        'ready': live and scheduler_running and upstream_ok,
+        'loop_lag': round(loop_lag, 3),
+        'scheduler_running': scheduler_running,
+        'last_upstream_success': last_success,
+        'last_upstream_failure': weather_service.last_failure_at,
+        'outbound_queue_depth': broadcast_queue_depth(),
+        'log_records_dropped': log_queue_handler.dropped,
+        'update_queue_depth': application.update_queue.qsize()
+    }
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """GET /health (жив ли цикл событий) и GET /ready (готов ли бот обслуживать)"""
+
+    def do_GET(self):
+        if self.path not in ('/health', '/ready'):
+            self.send_error(404)
+            return
+
+        status = get_health_status(self.server.application)
+        ok = status['live'] if self.path == '/health' else status['ready']
+        body = json.dumps(status).encode()
+
+        self.send_response(200 if ok else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_health_server(application):
+    """Эндпоинт состояния в отдельном потоке: отвечает, даже если цикл событий завис"""
+    try:
+        server = ThreadingHTTPServer((HEALTH_HOST, HEALTH_PORT), HealthHandler)
+    except OSError as e:
+        logger.error("Не удалось запустить проверку состояния на %s:%d: %s", HEALTH_HOST, HEALTH_PORT, e)
+        return
+
+    server.daemon_threads = True
+    server.application = application
+    threading.Thread(target=server.serve_forever, name='health-server', daemon=True).start()
+    logger.info("Проверка состояния: http://%s:%d/health", HEALTH_HOST, HEALTH_PORT)
+
+
+async def post_init(application):
+    """Фоновые задачи после инициализации бота"""
+    watchdog.start()
+    await resume_broadcasts(application)
+
+
+async def post_stop(application):
+    """Остановка фоновых задач: сторожевой таймер и рассылки"""
+    await watchdog.stop()
+    await drain_broadcasts(application)
+
+
 # Главная функция
 def main():
     """Запуск бота"""
-    if not TELEGRAM_TOKEN or not OPENWEATHER_API_KEY:
+    if not TELEGRAM_TOKEN or (not OPENWEATHER_API_KEY and WEATHER_TRANSPORT != 'replay'):
         print("Ошибка: Укажите TELEGRAM_TOKEN и OPENWEATHER_API_KEY в файле .env")
         return
 
     # Создание приложения
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .request(create_telegram_request())
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
 
     # Инициализация планировщика
     scheduler = AsyncIOScheduler()
     scheduler.start()
     application.bot_data['scheduler'] = scheduler
 
+    # Восстановление подписок и задач рассылки (повреждённые подписки пропускаются)
+    slots = set()
+    for key, value in broadcast_store.load_subscriptions().items():
+        try:
+            hour, minute = value['hour'], value['minute']
+        except (KeyError, TypeError):
+            hour = minute = None
+        if not is_valid_schedule_time(hour, minute):
+            logger.error("Пропущена подписка %s с неверным временем: %r", key, value)
+            continue
+
+        application.bot_data[key] = value
+        slots.add((hour, minute))
+
+    for hour, minute in slots:
+        add_slot_jobs(scheduler, application, hour, minute)
+
+    # Города, найденные геокодированием в прошлых запусках
+    for place in geocoder.places():
+        register_city(place)
+
+    # Тёплый старт из снимка кэша и периодическое сохранение
+    loaded = weather_service.load_snapshot(CACHE_SNAPSHOT_PATH)
+    logger.info("Загружено записей кэша из снимка: %d", loaded)
+    scheduler.add_job(
+        weather_service.save_snapshot,
+        IntervalTrigger(seconds=CACHE_SNAPSHOT_INTERVAL),
+        args=[CACHE_SNAPSHOT_PATH],
+        id='cache_snapshot',
+        name="Снимок кэша погоды"
+    )
+    scheduler.add_job(
+        log_queue_handler.report_dropped,
+        IntervalTrigger(seconds=60),
+        id='log_drops',
+        name="Отчёт об отброшенных записях лога"
+    )
+    scheduler.add_job(
+        geocoder.save,
+        IntervalTrigger(seconds=CACHE_SNAPSHOT_INTERVAL),
+        id='geocode_cache',
+        name="Сохранение кэша геокодирования"
+    )
+
+    # Эндпоинт проверки состояния
+    if HEALTH_PORT:
+        start_health_server(application)
+
+    # Ограничение частоты запросов до остальных обработчиков
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-1)
+
     # Добавление обработчиков команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("weather", handle_message))
-    application.add_handler(CommandHandler("forecast", handle_message))
-    application.add_handler(CommandHandler("schedule", schedule_command))
-    application.add_handler(CommandHandler("stop_schedule", stop_schedule_command))
-    application.add_handler(CommandHandler("send_to_group", send_to_group_command))
+    application.add_handler(CommandHandler("start", log_handler(start)))
+    application.add_handler(CommandHandler("help", log_handler(help_command)))
+    application.add_handler(CommandHandler("weather", log_handler(handle_message)))
+    application.add_handler(CommandHandler("forecast", log_handler(handle_message)))
+    application.add_handler(CommandHandler("schedule", log_handler(schedule_command)))
+    application.add_handler(CommandHandler("stop_schedule", log_handler(stop_schedule_command)))
+    application.add_handler(CommandHandler("send_to_group", log_handler(send_to_group_command)))
+    application.add_handler(CommandHandler("report", log_handler(report_command)))
+    application.add_handler(CommandHandler("lang", log_handler(lang_command)))
+    application.add_handler(CommandHandler("units", log_handler(units_command)))
+
+    # Инлайн-режим
+    application.add_handler(InlineQueryHandler(log_handler(inline_query)))
 
     # Обработчик текстовых сообщений (кнопок)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, log_handler(handle_message)))
 
     # Запуск бота
     print("🌤️ Бот погоды запущен...")
     print("Используйте кнопки для навигации")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
+    # Сохраняем кэш при остановке
+    weather_service.save_snapshot(CACHE_SNAPSHOT_PATH)
+    geocoder.save()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""Бенчмарк параллельной обработки обновлений.
+
+Смешанный трафик: большинство обновлений отвечается из кэша (быстро),
+часть ждёт OpenWeather (медленно). Для каждого лимита параллельности
+выводится пропускная способность и проверяется порядок внутри чатов.
+
+Второй сценарий: один «горячий» чат присылает пачку медленных обновлений,
+одновременно с ним приходят быстрые обновления из множества тихих чатов.
+Тихие чаты не должны ждать очереди горячего.
+
+Третий сценарий идёт через настоящий WeatherService с медленным поддельным
+транспортом: ответы из кэша не должны ждать медленных запросов к API,
+а одновременные промахи по одному городу — давать один запрос.
+
+Запуск: python bench_updates.py
+"""
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+import Pogodnik
+from Pogodnik import PerChatUpdateProcessor, fetch_current_weather
+
+CHATS = 100
+UPDATES_PER_CHAT = 10
+FAST_LATENCY = 0.002  # ответ из кэша
+SLOW_LATENCY = 0.05  # запрос к API
+SLOW_SHARE = 0.2
+LIMITS = (1, 4, 16, 64, 256)
+
+HOT_UPDATES = 8
+HOT_LATENCY = 0.5
+QUIET_CHATS = 50
+
+UPSTREAM_LATENCY = 1.0
+SLOW_FETCHES = 8
+CACHED_REPLIES = 20
+
+
+def make_traffic(seed: int = 42) -> list:
+    """Обновления вперемешку по чатам, у каждого своя задержка обработки"""
+    rng = random.Random(seed)
+    pending = {chat_id: 0 for chat_id in range(CHATS)}
+    traffic = []
+
+    while pending:
+        chat_id = rng.choice(list(pending))
+        latency = SLOW_LATENCY if rng.random() < SLOW_SHARE else FAST_LATENCY
+        traffic.append((chat_id, pending[chat_id], latency))
+
+        pending[chat_id] += 1
+        if pending[chat_id] == UPDATES_PER_CHAT:
+            del pending[chat_id]
+
+    return traffic
+
+
+async def run(limit: int, traffic: list) -> tuple:
+    """Обработка трафика так же, как это делает Application: задача на обновление"""
+    processor = PerChatUpdateProcessor(limit)
+    processed = {chat_id: [] for chat_id in range(CHATS)}
+
+    async def handler(chat_id: int, seq: int, latency: float):
+        await asyncio.sleep(latency)
+        processed[chat_id].append(seq)
+
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(processor.process_update(
+            SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id)),
+            handler(chat_id, seq, latency)
+        ))
+        for chat_id, seq, latency in traffic
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    ordered = all(seqs == sorted(seqs) for seqs in processed.values())
+    return elapsed, ordered
+
+
+async def run_hot_chat(limit: int) -> tuple:
+    """Горячий чат и тихие чаты: время до ответа в тихих чатах"""
+    processor = PerChatUpdateProcessor(limit)
+    quiet_latencies = []
+
+    async def handler(latency: float, started: float = None):
+        await asyncio.sleep(latency)
+        if started is not None:
+            quiet_latencies.append(time.perf_counter() - started)
+
+    def update(chat_id: int):
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+    # Горячий чат успевает поставить в очередь все обновления раньше тихих
+    tasks = [
+        asyncio.create_task(processor.process_update(update(-1), handler(HOT_LATENCY)))
+        for _ in range(HOT_UPDATES)
+    ]
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    tasks += [
+        asyncio.create_task(processor.process_update(update(chat_id), handler(FAST_LATENCY, started)))
+        for chat_id in range(QUIET_CHATS)
+    ]
+    await asyncio.gather(*tasks)
+
+    return sum(quiet_latencies) / len(quiet_latencies), max(quiet_latencies)
+
+
+class SlowTransport:
+    """Поддельный OpenWeather: каждый запрос блокирует поток на UPSTREAM_LATENCY"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url: str, params: dict) -> dict:
+        self.calls += 1
+        time.sleep(UPSTREAM_LATENCY)
+        now = int(time.time())
+        return {
+            'main': {'temp': 20.0, 'feels_like': 19.0, 'humidity': 50, 'pressure': 1013},
+            'weather': [{'id': 800, 'description': 'ясно', 'icon': '01d'}],
+            'wind': {'speed': 3.0},
+            'dt': now,
+            'sys': {'sunrise': now - 3600, 'sunset': now + 3600}
+        }
+
+
+async def run_cached_during_slow_fetches() -> tuple:
+    """Ответы из кэша одного города, пока идут промахи по другому"""
+    service = Pogodnik.weather_service
+    transport = service.transport = SlowTransport()
+    service._cache.clear()
+    cached_city, slow_city = 'Севастополь', 'Симферополь'
+
+    await fetch_current_weather(cached_city)
+    transport.calls = 0
+
+    async def cached_reply() -> float:
+        started = time.perf_counter()
+        await fetch_current_weather(cached_city)
+        return time.perf_counter() - started
+
+    slow = [asyncio.create_task(fetch_current_weather(slow_city)) for _ in range(SLOW_FETCHES)]
+    await asyncio.sleep(0.05)
+    latencies = await asyncio.gather(*(cached_reply() for _ in range(CACHED_REPLIES)))
+    await asyncio.gather(*slow)
+
+    return max(latencies), transport.calls
+
+
+async def main():
+    traffic = make_traffic()
+    print(f"Обновлений: {len(traffic)}, чатов: {CHATS}, доля медленных: {SLOW_SHARE:.0%}")
+    print(f"{'лимит':>6} {'время, с':>10} {'обн./с':>10} {'порядок':>8}")
+
+    for limit in LIMITS:
+        elapsed, ordered = await run(limit, traffic)
+        print(f"{limit:>6} {elapsed:>10.2f} {len(traffic) / elapsed:>10.0f} {'да' if ordered else 'НЕТ':>8}")
+
+    print()
+    print(f"Горячий чат: {HOT_UPDATES} обновлений по {HOT_LATENCY} с, тихих чатов: {QUIET_CHATS}")
+    print(f"{'лимит':>6} {'средн., с':>10} {'макс., с':>10}")
+
+    for limit in LIMITS:
+        average, worst = await run_hot_chat(limit)
+        print(f"{limit:>6} {average:>10.3f} {worst:>10.3f}")
+
+    print()
+    worst, calls = await run_cached_during_slow_fetches()
+    print(f"Ответы из кэша во время {SLOW_FETCHES} медленных промахов по одному городу:")
+    print(f"  макс. задержка ответа из кэша: {worst:.3f} с")
+    print(f"  запросов к API: {calls}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())